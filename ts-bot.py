@@ -1,6 +1,15 @@
+import asyncio
+import functools
 import logging
 import os
-import requests
+from dataclasses import dataclass
+import aiohttp
+import orjson
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 from telegram import Update, Message
 from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
@@ -19,21 +28,85 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+LIVE_CHAT_ID_FILE = "config/live_chat_id.txt"
+
+# clientlist responses larger than this are parsed incrementally with ijson, if installed
+STREAM_MIN_BYTES = 1024 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class TSClient:
+
+    """TeamSpeak WebQuery session bound to its server URL."""
+
+    session: aiohttp.ClientSession
+    url: str
+
+
+# nicknames rarely change between polls, so memoize their escaped form
+escape_nickname = functools.lru_cache(maxsize=512)(escape_markdown)
+
+
+def add_user(user: dict, active: list[str], away: list[str]) -> None:
+
+    """Sort a TeamSpeak client into the active or away list."""
+
+    if user["client_type"] != '0':
+        return
+    if user["client_away"] == '1' or user["client_output_muted"] == '1' or user["client_input_muted"] == '1':
+        away.append(user["client_nickname"])
+    else:
+        active.append(user["client_nickname"])
+
+
+async def stream_user_list(content: aiohttp.StreamReader, active: list[str], away: list[str]) -> tuple[bool, dict]:
+
+    """Parse a clientlist response incrementally. Return whether a body was seen and the status."""
+
+    has_body, status, builder = False, {}, None
+    async for prefix, event, value in ijson.parse(content):
+        if prefix == "body" and event == "start_array":
+            has_body = True
+        elif prefix == "body.item" and event == "start_map":
+            builder = ijson.ObjectBuilder()
+
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == "body.item" and event == "end_map":
+                add_user(builder.value, active, away)
+                builder = None
+        elif prefix in ("status.code", "status.message"):
+            status[prefix.removeprefix("status.")] = value
+
+    return has_body, status
+
 
-def get_user_list(url: str, apikey: str) -> list[str]:
+async def get_user_list(ts: TSClient) -> tuple[list[str], list[str]]:
 
     """Get the user list from the TeamSpeak server."""
 
-    r = requests.get(url+"/1/clientlist?-voice%20-away", headers={"X-API-Key": apikey})
-    body = r.json()["body"]
-    users = [user for user in body if user["client_type"] == '0']
-    away_nicknames = {user["client_nickname"] for user in users if user["client_away"] == '1' or user["client_output_muted"] == '1' or user["client_input_muted"] == '1'}
+    # TeamSpeak keeps nicknames unique per server, so no deduplication is needed
+    active, away = [], []
 
+    # clientlist flags only add fields; -voice and -away are the minimum needed for the muted/away checks
+    async with ts.session.get(ts.url+"/1/clientlist?-voice%20-away") as r:
+        r.raise_for_status()
 
-    all_nicknames = {user["client_nickname"] for user in users}
-    active_nicknames = all_nicknames - away_nicknames
+        # orjson is faster on typical rosters; only stream bodies big enough for memory to matter
+        if ijson is not None and (r.content_length or 0) > STREAM_MIN_BYTES:
+            has_body, status = await stream_user_list(r.content, active, away)
+        else:
+            data = await r.json(loads=orjson.loads)
+            has_body, status = "body" in data, data.get("status", {})
+            for user in data.get("body", ()):
+                add_user(user, active, away)
 
-    return sorted(active_nicknames, key=str.lower), sorted(away_nicknames, key=str.lower)
+    if not has_body or status.get("code", 0) != 0:
+        raise ValueError(f"TeamSpeak clientlist query failed: {status}")
+
+    active.sort(key=str.lower)
+    away.sort(key=str.lower)
+    return active, away
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -61,24 +134,18 @@ def format_user_list(active: list[str], away: list[str]) -> str:
 
     """Format the user list from active and away users."""
 
-    temp = f"{len(active)}\\+_{len(away)}_: "
-    temp += ", ".join([escape_markdown(x) for x in active])
+    head = f"{len(active)}\\+_{len(away)}_: " + ", ".join(map(escape_nickname, active))
 
-    if len(away) > 0:
-        temp += " \\+ _" + escape_markdown(away[0]) + "_"
-    for user in away[1:]:
-        temp += f", _{escape_markdown(user)}_"
-    
-    return temp 
+    if away:
+        return head + " \\+ " + ", ".join(f"_{escape_nickname(user)}_" for user in away)
+    return head
 
 
 async def ts_get_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     """Get the user list from the TeamSpeak server."""
 
-    ts_url = context.bot_data["ts_url"]
-    ts_apikey = context.bot_data["ts_apikey"]
-    active, away = get_user_list(ts_url, ts_apikey)
+    active, away = await get_user_list(context.bot_data["ts"])
 
     await update.message.reply_text(format_user_list(active, away), parse_mode="MarkdownV2")
 
@@ -87,29 +154,42 @@ async def get_live_message(context: ContextTypes.DEFAULT_TYPE) -> Message:
 
     """Get the live message from the bot data or file."""
 
-    if context.bot_data.get("live_msg") is None:
-        logger.info("No live message to update. Trying to load message ID from file.")
-        try:
-            with open("config/live_chat_id.txt", "r") as f:
-                chat_id, message_id  = [int(x) for x in f.read().strip().split(",")]
-                live_msg = await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text="Initializing..."
-                )
-                logger.info("Live message created from chat ID in file.")
-                context.bot_data["live_msg"] = live_msg
-
-        except Exception as e:
-            logger.error(f"Failed to read chat ID from file: {e}")
-    
-    if context.bot_data.get("live_msg") is not None:
-        return context.bot_data["live_msg"]
-    
+    live_msg = context.bot_data.get("live_msg")
+    if live_msg is not None:
+        return live_msg
+
+    logger.info("No live message to update. Trying to load message ID from file.")
+    try:
+        with open(LIVE_CHAT_ID_FILE, "r") as f:
+            chat_id, message_id  = [int(x) for x in f.read().strip().split(",")]
+            live_msg = await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text="Initializing..."
+            )
+            logger.info("Live message created from chat ID in file.")
+            context.bot_data["live_msg"] = live_msg
+            context.bot_data.pop("last_lists", None)
+            return live_msg
+
+    except Exception as e:
+        logger.error(f"Failed to read chat ID from file: {e}")
+
     logger.info("No live message found.")
     return None
 
 
+def write_live_chat_id(chat_id: int, message_id: int) -> None:
+
+    """Atomically write the live message chat and message ID to file."""
+
+    os.makedirs(os.path.dirname(LIVE_CHAT_ID_FILE), exist_ok=True)
+    tmp = LIVE_CHAT_ID_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(f"{chat_id},{message_id}")
+    os.replace(tmp, LIVE_CHAT_ID_FILE)
+
+
 async def ts_get_users_live(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     """Get the user list from the TeamSpeak server. Live version."""
@@ -119,24 +199,22 @@ async def ts_get_users_live(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # there is an existing live message, inform the user and return
     if live_msg is not None:
-        live_msg = context.bot_data["live_msg"]
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
+        await update.message.reply_text(
+            "Live message already exists. Please wait for it to update.",
             reply_to_message_id=live_msg.message_id,
-            text="Live message already exists. Please wait for it to update."
         )
         return
 
     # no existing live message, create one
     # Send the message and store the Message in bot_data and file
-    active, away = get_user_list(context.bot_data["ts_url"], context.bot_data["ts_apikey"])
-    sent_message = await context.bot.send_message(chat_id=update.effective_chat.id, text=format_user_list(active, away), parse_mode="MarkdownV2")
+    active, away = await get_user_list(context.bot_data["ts"])
+    text = format_user_list(active, away)
+    sent_message = await update.message.reply_text(text, parse_mode="MarkdownV2", do_quote=False)
     context.bot_data["live_msg"] = sent_message  # Store the Message object
+    context.bot_data["last_lists"] = (tuple(active), tuple(away))
 
-    # save the chat id persistently
-    os.makedirs("config", exist_ok=True)
-    with open("config/live_chat_id.txt", "w") as f:
-        f.write(f"{update.effective_chat.id},{sent_message.message_id}")
+    # save the chat id persistently; this only runs for a newly created live message
+    await asyncio.to_thread(write_live_chat_id, update.effective_chat.id, sent_message.message_id)
 
 
 async def update_live_message(context: ContextTypes.DEFAULT_TYPE):
@@ -145,10 +223,17 @@ async def update_live_message(context: ContextTypes.DEFAULT_TYPE):
 
     live_msg = await get_live_message(context)
     if live_msg is not None:
-        active, away = get_user_list(context.bot_data["ts_url"], context.bot_data["ts_apikey"])
+        active, away = await get_user_list(context.bot_data["ts"])
+
+        # the lists are sorted, so this identity ignores the order TeamSpeak returned clients in;
+        # skip formatting and the Telegram call if nothing changed since the last edit
+        lists = (tuple(active), tuple(away))
+        if lists == context.bot_data.get("last_lists"):
+            return
+
         text = format_user_list(active, away)
-        if text != live_msg.text_markdown_v2:
-            context.bot_data["live_msg"] = await live_msg.edit_text(text, parse_mode="MarkdownV2")
+        context.bot_data["live_msg"] = await live_msg.edit_text(text, parse_mode="MarkdownV2")
+        context.bot_data["last_lists"] = lists
         return
 
 
@@ -165,6 +250,27 @@ async def check_perms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         raise ApplicationHandlerStop
 
 
+async def post_init(application: Application) -> None:
+
+    """Create the shared TeamSpeak WebQuery client."""
+
+    session = aiohttp.ClientSession(
+        headers={"X-API-Key": os.getenv("TS_APIKEY")},
+        timeout=aiohttp.ClientTimeout(total=5),
+        connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=75),
+    )
+    application.bot_data["ts"] = TSClient(session=session, url=os.getenv("TS_URL"))
+
+
+async def post_shutdown(application: Application) -> None:
+
+    """Close the shared HTTP session."""
+
+    ts = application.bot_data.get("ts")
+    if ts is not None:
+        await ts.session.close()
+
+
 def main() -> None:
 
     """Start the bot."""
@@ -172,12 +278,19 @@ def main() -> None:
     # Create the Application and pass it your bot's token.
 
     token = os.getenv("BOT_TOKEN")
-    application = Application.builder().token(token).build()
+    application = (
+        Application.builder()
+        .token(token)
+        .connect_timeout(5)
+        .read_timeout(15)
+        .pool_timeout(5)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     job_queue = application.job_queue
     job_queue.run_repeating(update_live_message, interval=60, first=10)
-    application.bot_data["allowed_groups"] = list(map(int, os.getenv("ALLOWED_GROUPS", "").split(",")))
-    application.bot_data["ts_apikey"] = os.getenv("TS_APIKEY")
-    application.bot_data["ts_url"] = os.getenv("TS_URL")
+    application.bot_data["allowed_groups"] = frozenset(map(int, os.getenv("ALLOWED_GROUPS", "").split(",")))
 
     # enforce permission for all
     check_perms_handler = TypeHandler(Update, check_perms)
@@ -190,7 +303,8 @@ def main() -> None:
     application.add_handler(CommandHandler("tslive", ts_get_users_live))
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Telegram holds long polls for up to 50 s, so there is no need to poll more often
+    application.run_polling(allowed_updates=[Update.MESSAGE], timeout=50, poll_interval=0.0)
 
 
 if __name__ == "__main__":